@@ -1,27 +1,102 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse, FileResponse
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, FileResponse, ORJSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, TypeAdapter
+import asyncio
+import io
 import json
+import httpx
 import ollama
-from typing import List, Dict, Any, AsyncGenerator
+import orjson
+from typing import List, Dict, Any, AsyncGenerator, Callable, Sequence
 from contextlib import asynccontextmanager
 
 from config import OLLAMA_HOST, MODEL_NAME, PORT, MAX_TOOL_ROUNDS, TEAM_MEMBERS, TEAM_LEADER
-from tools import TOOLS, dispatch_tool
+from tools import TOOLS, dispatch_tool, shutdown_python_workers
 
 # 导出只包含 python_exec 的工具列表（给普通角色使用）
-PYTHON_ONLY_TOOLS = [t for t in TOOLS if t.get("function", {}).get("name") == "python_exec"]
+PYTHON_ONLY_TOOLS = tuple(t for t in TOOLS if t.get("function", {}).get("name") == "python_exec")
+
+# 旧轮次工具结果超过该长度时替换为占位符
+_TOOL_RESULT_KEEP_CHARS = 256
+_TOOL_RESULT_PLACEHOLDER = "（省略，已完成）"
+
+# 团队成员并发请求 Ollama 的上限（进程内各团队会话共享，避免同时压垮模型服务）。
+# 注意：每个 uvicorn worker 进程各有一份，整体上限为 worker 数 × 3。
+_MEMBER_SEMAPHORE = asyncio.Semaphore(3)
+
+
+def _json_bytes(obj: Any) -> bytes:
+    """用 orjson 编码；遇到 orjson 拒绝的内容（如孤立的代理字符）时退回标准库 json 转义输出。"""
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        return json.dumps(obj).encode()
+
+
+def _sse_frame(obj: Any) -> bytes:
+    """将对象编码为一条 SSE data 帧（UTF-8 bytes，含双换行）。"""
+    return b"data: " + _json_bytes(obj) + b"\n\n"
+
+
+# 团队成员 / 组长的展示元信息，以及内容固定的 SSE 帧，导入时预先构建
+_META_KEYS = ("id", "name", "display_name", "avatar")
+_MEMBER_META = {m["id"]: {k: m[k] for k in _META_KEYS} for m in TEAM_MEMBERS}
+_LEADER_META = {k: TEAM_LEADER[k] for k in _META_KEYS}
+
+_MEMBER_START_FRAMES = {
+    member_id: _sse_frame({"team_event": {"type": "member_start", **meta}})
+    for member_id, meta in _MEMBER_META.items()
+}
+_MEMBER_END_FRAMES = {
+    m["id"]: _sse_frame({"team_event": {"type": "member_end", "id": m["id"]}})
+    for m in TEAM_MEMBERS
+}
+_LEADER_START_FRAME = _sse_frame({"team_event": {"type": "leader_start", **_LEADER_META}})
+_LEADER_END_FRAME = _sse_frame({"team_event": {"type": "leader_end", "id": TEAM_LEADER["id"]}})
+_DONE_FRAME = b"data: [DONE]\n\n"
+_PING_FRAME = b": ping\n\n"
+_PING_INTERVAL_SECONDS = 15.0
+
+# SSE 响应头：禁止缓存，并告知 nginx 等反向代理不要缓冲/压缩流
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Connection": "keep-alive"}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print(f"[config] OLLAMA_HOST = {OLLAMA_HOST}")
-    print(f"[config] MODEL_NAME  = {MODEL_NAME}")
-    print(f"[config] PORT        = {PORT}")
+    # 全局复用同一个 Ollama 客户端（共享 httpx 连接池，保持 keep-alive）
+    app.state.ollama = ollama.AsyncClient(
+        host=OLLAMA_HOST,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    )
     yield
+    await app.state.ollama._client.aclose()
+    shutdown_python_workers()
+
+class ORJSONRequest(Request):
+    """请求体 JSON 使用 orjson 解析。"""
 
-app = FastAPI(title="ChatGPT-like Web Interface", lifespan=lifespan)
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """将路由收到的请求替换为 ORJSONRequest。"""
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+
+        async def handler(request: Request):
+            return await original_handler(ORJSONRequest(request.scope, request.receive))
+
+        return handler
+
+
+app = FastAPI(title="ChatGPT-like Web Interface", lifespan=lifespan, default_response_class=ORJSONResponse)
+app.router.route_class = ORJSONRoute
 
 # 配置 CORS
 app.add_middleware(
@@ -47,6 +122,10 @@ class ChatRequest(BaseModel):
     stream: bool = True
 
 
+# 批量将 Message 列表转为 dict 列表（由 pydantic-core 完成，免去逐条构造）
+_MSG_ADAPTER = TypeAdapter(List[Message])
+
+
 # ──────────────────────────────────────────────────────────────
 # 核心流式循环（供所有模式复用）
 # ──────────────────────────────────────────────────────────────
@@ -55,7 +134,7 @@ async def _streaming_loop(
     conversation: List[Dict[str, Any]],
     temperature: float,
     max_tokens: int,
-    tools: List[Dict[str, Any]] | None = None,
+    tools: Sequence[Dict[str, Any]] | None = None,
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """
     处理多轮流式调用（含工具调用），逐个 yield event dict：
@@ -63,54 +142,64 @@ async def _streaming_loop(
       {"type": "content",  "text": "..."}
       {"type": "tool_request", "tool": "...", "args": {...}}
       {"type": "tool_result",  "tool": "...", "result": {...}}
+      {"type": "ping"}  （工具执行较久时的保活事件）
     """
     ctx: List[Dict[str, Any]] = list(conversation)
+    round_tools = TOOLS if tools is None else tools
 
     for _ in range(MAX_TOOL_ROUNDS):
         stream_response = await client.chat(
             model=MODEL_NAME,
             messages=ctx,
             stream=True,
-            tools=TOOLS if tools is None else tools,
+            tools=round_tools,
             options={"temperature": temperature, "num_predict": max_tokens},
         )
 
-        collected_content: List[str] = []
-        collected_thinking: List[str] = []
+        content_buf = io.StringIO()
+        thinking_buf = io.StringIO()
         collected_tool_calls: List[Dict[str, Any]] = []
 
         async for chunk in stream_response:
-            msg = chunk.get("message") or {}
+            msg = chunk["message"] if "message" in chunk else None
+            if msg is None:
+                continue
             thinking = msg.get("thinking")
             content = msg.get("content")
-            tool_calls = msg.get("tool_calls") or []
+            tool_calls = msg.get("tool_calls")
 
             if isinstance(thinking, str) and thinking:
-                collected_thinking.append(thinking)
+                thinking_buf.write(thinking)
                 yield {"type": "thinking", "text": thinking}
             if isinstance(content, str) and content:
-                collected_content.append(content)
+                content_buf.write(content)
                 yield {"type": "content", "text": content}
             if tool_calls:
                 collected_tool_calls = tool_calls
 
         # 整理本轮 assistant 消息并追加到上下文
         assistant_msg: Dict[str, Any] = {"role": "assistant"}
-        full_content = "".join(collected_content).strip()
-        full_thinking = "".join(collected_thinking).strip()
+        full_content = content_buf.getvalue().strip()
+        full_thinking = thinking_buf.getvalue().strip()
         if full_content:
             assistant_msg["content"] = full_content
         if full_thinking:
             assistant_msg["thinking"] = full_thinking
         if collected_tool_calls:
             assistant_msg["tool_calls"] = collected_tool_calls
-        if assistant_msg.keys() - {"role"}:
+        if full_content or full_thinking or collected_tool_calls:
             ctx.append(assistant_msg)
 
         # 无工具调用：本轮正常结束
         if not collected_tool_calls:
             return
 
+        # 压缩此前轮次的长工具结果，只保留最近一轮的完整输出，避免上下文随轮次膨胀
+        # 只处理本循环追加的消息：conversation 中的 dict 为调用方所有（团队模式下多个成员共享）
+        for m in ctx[len(conversation):]:
+            if m["role"] == "tool" and len(m.get("content", "")) > _TOOL_RESULT_KEEP_CHARS:
+                m["content"] = _TOOL_RESULT_PLACEHOLDER
+
         # 执行工具并追加结果
         for tool_call in collected_tool_calls:
             function_data = tool_call.get("function") or {}
@@ -119,14 +208,25 @@ async def _streaming_loop(
 
             yield {"type": "tool_request", "tool": tool_name, "args": args}
 
-            tool_result = dispatch_tool(tool_name, function_data.get("arguments"))
+            # 工具执行期间定期产出 ping 事件，防止代理断开空闲的 SSE 连接
+            task = asyncio.create_task(dispatch_tool(tool_name, function_data.get("arguments")))
+            try:
+                while True:
+                    done, _ = await asyncio.wait({task}, timeout=_PING_INTERVAL_SECONDS)
+                    if done:
+                        break
+                    yield {"type": "ping"}
+            finally:
+                if not task.done():
+                    task.cancel()
+            tool_result = task.result()
 
             yield {"type": "tool_result", "tool": tool_name, "result": tool_result}
 
             tool_msg: Dict[str, Any] = {
                 "role": "tool",
                 "name": tool_name,
-                "content": json.dumps(tool_result, ensure_ascii=False),
+                "content": _json_bytes(tool_result).decode(),
             }
             tool_call_id = tool_call.get("id")
             if tool_call_id:
@@ -137,44 +237,51 @@ async def _streaming_loop(
     yield {"type": "content", "text": "工具调用轮次达到上限，请缩小问题范围后重试。"}
 
 
-def _sse_from_event(event: Dict[str, Any]) -> str:
-    """将 _streaming_loop event 转换为 SSE 字符串（含双换行）。"""
+def _sse_from_event(event: Dict[str, Any], member: str | None = None) -> bytes:
+    """将 _streaming_loop event 转换为 SSE 帧（UTF-8 bytes，含双换行）。member 非空时附带成员 id。"""
+    if event["type"] == "ping":
+        return _PING_FRAME
     if event["type"] == "thinking":
-        return f"data: {json.dumps({'choices': [{'delta': {'thinking': event['text']}}]})}\n\n"
-    if event["type"] == "content":
-        return f"data: {json.dumps({'choices': [{'delta': {'content': event['text']}}]})}\n\n"
-    if event["type"] == "tool_request":
-        return f"data: {json.dumps({'tool_event': {'type': 'request', 'tool': event['tool'], 'arguments': event['args']}}, ensure_ascii=False)}\n\n"
-    if event["type"] == "tool_result":
-        return f"data: {json.dumps({'tool_event': {'type': 'result', 'tool': event['tool'], 'result': event['result']}}, ensure_ascii=False)}\n\n"
-    return ""
+        payload = {"choices": [{"delta": {"thinking": event["text"]}}]}
+    elif event["type"] == "content":
+        payload = {"choices": [{"delta": {"content": event["text"]}}]}
+    elif event["type"] == "tool_request":
+        payload = {"tool_event": {"type": "request", "tool": event["tool"], "arguments": event["args"]}}
+    elif event["type"] == "tool_result":
+        payload = {"tool_event": {"type": "result", "tool": event["tool"], "result": event["result"]}}
+    else:
+        return b""
+    if member is not None:
+        payload["member"] = member
+    return _sse_frame(payload)
 
 
 # ──────────────────────────────────────────────────────────────
 # 路由：普通聊天
 # ──────────────────────────────────────────────────────────────
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """普通单 Agent 聊天，支持流式响应。"""
-    outgoing = [{"role": m.role, "content": m.content} for m in request.messages]
+    outgoing = _MSG_ADAPTER.dump_python(request.messages, mode="python")
 
     if request.stream:
         async def generate():
             try:
-                client = ollama.AsyncClient(host=OLLAMA_HOST)
+                client = http_request.app.state.ollama
                 async for event in _streaming_loop(client, outgoing, request.temperature, request.max_tokens, tools=PYTHON_ONLY_TOOLS):
                     sse = _sse_from_event(event)
                     if sse:
                         yield sse
-                yield "data: [DONE]\n\n"
+                        await asyncio.sleep(0)  # 让出事件循环，逐帧刷新到客户端
+                yield _DONE_FRAME
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield _sse_frame({"error": str(e)})
 
-        return StreamingResponse(generate(), media_type="text/event-stream")
+        return StreamingResponse(generate(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
     # 非流式：收集全部内容后返回
     try:
-        client = ollama.AsyncClient(host=OLLAMA_HOST)
+        client = http_request.app.state.ollama
         full_content, full_thinking = "", ""
         async for event in _streaming_loop(client, outgoing, request.temperature, request.max_tokens, tools=PYTHON_ONLY_TOOLS):
             if event["type"] == "content":
@@ -191,82 +298,127 @@ async def chat(request: ChatRequest):
 # ──────────────────────────────────────────────────────────────
 # 路由：团队聊天
 # ──────────────────────────────────────────────────────────────
+async def _run_member(
+    client: ollama.AsyncClient,
+    member: Dict[str, Any],
+    outgoing: List[Dict[str, Any]],
+    request: ChatRequest,
+    queue: asyncio.Queue,
+) -> None:
+    """单个成员作答，将 (member_id, event) 推入队列；异常原样入队，结束时推入 None 哨兵。"""
+    member_ctx = [
+        {"role": "system", "content": member["system_prompt"]},
+        *outgoing,
+    ]
+    try:
+        # 等待并发名额期间同样定期推送 ping，避免排队中的会话被代理断开
+        acquire = asyncio.ensure_future(_MEMBER_SEMAPHORE.acquire())
+        try:
+            while True:
+                done, _ = await asyncio.wait({acquire}, timeout=_PING_INTERVAL_SECONDS)
+                if done:
+                    break
+                await queue.put((member["id"], {"type": "ping"}))
+        except BaseException:
+            if not acquire.done():
+                acquire.cancel()
+            elif not acquire.cancelled():
+                _MEMBER_SEMAPHORE.release()
+            raise
+        try:
+            async for event in _streaming_loop(client, member_ctx, request.temperature, request.max_tokens, tools=PYTHON_ONLY_TOOLS):
+                await queue.put((member["id"], event))
+        finally:
+            _MEMBER_SEMAPHORE.release()
+    except Exception as e:
+        await queue.put((member["id"], e))
+    finally:
+        await queue.put((member["id"], None))
+
+
 @app.post("/api/chat/team")
-async def chat_team(request: ChatRequest):
-    """团队多 Agent 聊天：Rex / Nova / Vera 顺序回答 → Sage 综合总结。"""
-    outgoing = [{"role": m.role, "content": m.content} for m in request.messages]
+async def chat_team(request: ChatRequest, http_request: Request):
+    """团队多 Agent 聊天：Rex / Nova / Vera 并发回答 → Sage 综合总结。"""
+    outgoing = _MSG_ADAPTER.dump_python(request.messages, mode="python")
 
     async def generate():
         try:
-            client = ollama.AsyncClient(host=OLLAMA_HOST)
-            member_answers: Dict[str, str] = {}
-
-            # ── 三位成员依次回答（不使用工具，专注回答） ──────────────────────────────
-            for member in TEAM_MEMBERS:
-                member_system = member["system_prompt"]
-                member_ctx = [
-                    {"role": "system", "content": member_system},
-                    *outgoing,
-                ]
-                meta = {k: member[k] for k in ("id", "name", "display_name", "avatar")}
-                yield f"data: {json.dumps({'team_event': {'type': 'member_start', **meta}}, ensure_ascii=False)}\n\n"
-
-                full_content = ""
-                async for event in _streaming_loop(client, member_ctx, request.temperature, request.max_tokens, tools=PYTHON_ONLY_TOOLS):
-                    sse = _sse_from_event(event)
+            client = http_request.app.state.ollama
+            member_bufs = {m["id"]: io.StringIO() for m in TEAM_MEMBERS}
+
+            # ── 三位成员并发回答，帧经由队列交错推送（带 member 字段区分） ──────────
+            queue: asyncio.Queue = asyncio.Queue()
+            tasks = [
+                asyncio.create_task(_run_member(client, member, outgoing, request, queue))
+                for member in TEAM_MEMBERS
+            ]
+            try:
+                for member in TEAM_MEMBERS:
+                    yield _MEMBER_START_FRAMES[member["id"]]
+
+                active = len(tasks)
+                while active:
+                    member_id, event = await queue.get()
+                    if event is None:
+                        active -= 1
+                        yield _MEMBER_END_FRAMES[member_id]
+                        continue
+                    if isinstance(event, Exception):
+                        raise event
+                    sse = _sse_from_event(event, member=member_id)
                     if sse:
                         yield sse
+                        await asyncio.sleep(0)
                     if event["type"] == "content":
-                        full_content += event["text"]
+                        member_bufs[member_id].write(event["text"])
+            finally:
+                for task in tasks:
+                    task.cancel()
 
-                member_answers[member["id"]] = full_content
-                yield f"data: {json.dumps({'team_event': {'type': 'member_end', 'id': member['id']}}, ensure_ascii=False)}\n\n"
+            member_answers = {mid: buf.getvalue() for mid, buf in member_bufs.items() if buf.tell()}
 
             # ── 组长综合总结 ────────────────────────────────────
-            original_question = outgoing[-1]["content"] if outgoing else ""
-            member_sections = "\n\n".join(
-                f"<{m['id']}>\n{member_answers.get(m['id'], '（无回答）')}\n</{m['id']}>"
-                for m in TEAM_MEMBERS
-            )
-            # 组长的用户消息：包含原始问题 + 成员参考（作为内部背景）
+            # 组长上下文：原始问题 + 每位成员的回答各自作为一条 assistant 消息（内部参考）
+            # Ollama 客户端会丢弃消息的 name 字段，成员身份以前缀形式写入 content
             # 提示词明确告诉组长：仅作参考，不需在回复中提及
-            leader_user_msg = (
-                f"问题：{original_question}\n\n"
-                f"背景参考（内部分析，仅供参考）：\n{member_sections}"
-            )
-            leader_system = TEAM_LEADER["system_prompt"]
+            original_question = outgoing[-1]["content"] if outgoing else ""
             leader_ctx = [
-                {"role": "system", "content": leader_system},
-                {"role": "user", "content": leader_user_msg},
+                {"role": "system", "content": TEAM_LEADER["system_prompt"]},
+                {"role": "user", "content": original_question},
+                *[
+                    {"role": "assistant", "content": f"【{m['display_name']}】\n{member_answers.get(m['id'], '（无回答）')}"}
+                    for m in TEAM_MEMBERS
+                ],
+                {"role": "user", "content": "请综合以上参考给出最终回答。"},
             ]
-            leader_meta = {k: TEAM_LEADER[k] for k in ("id", "name", "display_name", "avatar")}
-            yield f"data: {json.dumps({'team_event': {'type': 'leader_start', **leader_meta}}, ensure_ascii=False)}\n\n"
+            yield _LEADER_START_FRAME
 
             leader_answer = ""
             async for event in _streaming_loop(client, leader_ctx, request.temperature, request.max_tokens, tools=PYTHON_ONLY_TOOLS):
                 sse = _sse_from_event(event)
                 if sse:
                     yield sse
+                    await asyncio.sleep(0)
                 if event["type"] == "content":
                     leader_answer += event["text"]
 
-            yield f"data: {json.dumps({'team_event': {'type': 'leader_end', 'id': TEAM_LEADER['id']}}, ensure_ascii=False)}\n\n"
+            yield _LEADER_END_FRAME
 
-            yield "data: [DONE]\n\n"
+            yield _DONE_FRAME
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield _sse_frame({"error": str(e)})
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
 
 # ──────────────────────────────────────────────────────────────
 # 路由：健康检查 / 静态文件
 # ──────────────────────────────────────────────────────────────
 @app.get("/api/health")
-async def health_check():
+async def health_check(http_request: Request):
     """健康检查接口"""
     try:
-        client = ollama.AsyncClient(host=OLLAMA_HOST)
+        client = http_request.app.state.ollama
         await client.list()
         ollama_status = "ok"
     except Exception:
@@ -283,5 +435,19 @@ async def read_root():
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    # 在主进程打印一次配置（lifespan 会在每个 worker 中各执行一次）
+    print(f"[config] OLLAMA_HOST = {OLLAMA_HOST}")
+    print(f"[config] MODEL_NAME  = {MODEL_NAME}")
+    print(f"[config] PORT        = {PORT}")
+    # 多 worker 需以导入字符串形式传入应用
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=PORT,
+        workers=min(4, os.cpu_count() or 1),
+        loop="auto",  # 已安装 uvloop 时自动使用（Windows 无 uvloop，退回 asyncio）
+        http="httptools",
+        log_level="warning",
+    )
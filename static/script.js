@@ -598,14 +598,9 @@ async function streamTeamResponse() {
     const reader = response.body.getReader();
     const decoder = new TextDecoder();
 
-    // DOM refs for current active section
+    // 成员并发作答：按 member id 维护各自的 DOM refs 与文本缓冲
     let teamBlock         = null;
-    let currentAnswerContent  = null;
-    let currentThoughtsWrap   = null;
-    let currentThoughtsContent = null;
-    let currentToolsWrap  = null;
-    let currentToolsContent   = null;
-    let isLeader          = false;
+    const memberSections  = {};
 
     // Leader DOM refs
     let leaderMessageDiv      = null;
@@ -615,18 +610,9 @@ async function streamTeamResponse() {
     let leaderToolsWrap       = null;
     let leaderToolsContent    = null;
 
-    // Per-section text buffers
-    let fullAnswer   = '';
-    let fullThinking = '';
-    let sawThinkingDelta = false;
-
     let leaderFullAnswer   = '';
     let leaderFullThinking = '';
 
-    function resetBuffers() {
-        fullAnswer = ''; fullThinking = ''; sawThinkingDelta = false;
-    }
-
     try {
         while (true) {
             const { done, value } = await reader.read();
@@ -649,21 +635,14 @@ async function streamTeamResponse() {
 
                         if (evt.type === 'member_start') {
                             if (!teamBlock) teamBlock = _createTeamBlock();
-                            resetBuffers();
-                            isLeader = false;
                             const s = _addTeamMemberSection(teamBlock, evt);
-                            currentAnswerContent   = s.answerContent;
-                            currentThoughtsWrap    = s.thoughtsWrap;
-                            currentThoughtsContent = s.thoughtsContent;
-                            currentToolsWrap       = s.toolsWrap;
-                            currentToolsContent    = s.toolsContent;
+                            memberSections[evt.id] = { ...s, fullAnswer: '', fullThinking: '' };
 
                         } else if (evt.type === 'member_end') {
-                            _collapseThoughtsAndTools(currentThoughtsWrap, currentToolsWrap, fullThinking);
+                            const s = memberSections[evt.id];
+                            if (s) _collapseThoughtsAndTools(s.thoughtsWrap, s.toolsWrap, s.fullThinking);
 
                         } else if (evt.type === 'leader_start') {
-                            resetBuffers();
-                            isLeader = true;
                             leaderMessageDiv      = _addTeamLeaderBubble(evt);
                             leaderAnswerContent   = leaderMessageDiv.querySelector('.answer-content');
                             leaderThoughtsWrap    = leaderMessageDiv.querySelector('.thoughts');
@@ -677,9 +656,12 @@ async function streamTeamResponse() {
                     }
 
                     // ── 工具事件 ──────────────────────────────────
+                    // 带 member 字段的帧属于对应成员，其余属于组长
+                    const member = parsed.member ? memberSections[parsed.member] : null;
+
                     if (parsed.tool_event) {
-                        const tw = isLeader ? leaderToolsWrap  : currentToolsWrap;
-                        const tc = isLeader ? leaderToolsContent : currentToolsContent;
+                        const tw = member ? member.toolsWrap    : leaderToolsWrap;
+                        const tc = member ? member.toolsContent : leaderToolsContent;
                         appendToolLog(tw, tc, parsed.tool_event);
                         scrollToBottom();
                         continue;
@@ -689,7 +671,15 @@ async function streamTeamResponse() {
                     if (!parsed.choices) continue;
                     const delta = parsed.choices[0].delta;
 
-                    if (isLeader) {
+                    if (member) {
+                        if (delta.thinking) member.fullThinking += delta.thinking;
+                        if (delta.content)  member.fullAnswer   += delta.content;
+                        if (member.thoughtsWrap && member.fullThinking.trim()) {
+                            member.thoughtsWrap.style.display = 'block';
+                            renderMarkdownWithMath(member.thoughtsContent, member.fullThinking);
+                        }
+                        if (member.answerContent) renderMarkdownWithMath(member.answerContent, member.fullAnswer);
+                    } else {
                         if (delta.thinking) leaderFullThinking += delta.thinking;
                         if (delta.content)  leaderFullAnswer   += delta.content;
                         if (leaderThoughtsWrap && leaderFullThinking.trim()) {
@@ -697,14 +687,6 @@ async function streamTeamResponse() {
                             renderMarkdownWithMath(leaderThoughtsContent, leaderFullThinking);
                         }
                         if (leaderAnswerContent) renderMarkdownWithMath(leaderAnswerContent, leaderFullAnswer);
-                    } else {
-                        if (delta.thinking) { sawThinkingDelta = true; fullThinking += delta.thinking; }
-                        if (delta.content)  fullAnswer += delta.content;
-                        if (currentThoughtsWrap && fullThinking.trim()) {
-                            currentThoughtsWrap.style.display = 'block';
-                            renderMarkdownWithMath(currentThoughtsContent, fullThinking);
-                        }
-                        if (currentAnswerContent) renderMarkdownWithMath(currentAnswerContent, fullAnswer);
                     }
 
                     scrollToBottom();
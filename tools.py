@@ -3,11 +3,17 @@ tools.py — 工具定义、执行与记忆管理
 """
 from __future__ import annotations
 
+import asyncio
 import json
+import os
 import subprocess
 import sys
+import tempfile
+import threading
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
+
+import orjson
 
 from config import (
     PYTHON_TOOL_TIMEOUT_SECONDS,
@@ -21,23 +27,72 @@ MEMORY_FILE = Path(_MEMORY_FILE)
 # 记忆管理（单条字符串，覆盖写入）
 # ──────────────────────────────────────────────────────────────
 
+# 解析后的记忆缓存：(文件标识, 内容)，文件被修改后自动重新读取。
+# 标识同时包含 mtime / size / inode，避免部分文件系统 mtime 精度过粗时漏判
+_mem_cache: tuple[tuple[int, int, int], str] | None = None
+
+
+def _file_key(st: os.stat_result) -> tuple[int, int, int]:
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
 def load_memories() -> str:
     """从 MEMORY_FILE 读取记忆并返回字符串，无内容时返回空字符串。"""
-    if MEMORY_FILE.exists():
-        try:
-            data = json.loads(MEMORY_FILE.read_text(encoding="utf-8"))
-            if isinstance(data, dict):
-                return str(data.get("content", ""))
-        except Exception:
-            pass
-    return ""
+    global _mem_cache
+    try:
+        st = MEMORY_FILE.stat()
+    except FileNotFoundError:
+        return ""
+    if _mem_cache is not None and _mem_cache[0] == _file_key(st):
+        return _mem_cache[1]
+    content = ""
+    try:
+        data = json.loads(MEMORY_FILE.read_text(encoding="utf-8"))
+        if isinstance(data, dict):
+            content = str(data.get("content", ""))
+    except Exception:
+        pass
+    _mem_cache = (_file_key(st), content)
+    return content
+
+
+def _memory_file_mode() -> int:
+    try:
+        return MEMORY_FILE.stat().st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
 
 
 def _save_memories(content: str) -> None:
-    """将记忆字符串保存到 MEMORY_FILE。"""
-    MEMORY_FILE.write_text(
-        json.dumps({"content": content}, ensure_ascii=False, indent=2), encoding="utf-8"
+    """将记忆字符串保存到 MEMORY_FILE，并同步更新缓存。"""
+    global _mem_cache
+    obj = {"content": content}
+    try:
+        data = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    except TypeError:
+        # orjson 拒绝孤立的代理字符等内容，退回标准库 json 转义输出
+        data = json.dumps(obj, indent=2).encode()
+    # 先写同目录下唯一命名的临时文件再原子替换：避免写入中途崩溃损坏记忆文件，
+    # 多个 worker 进程同时写入时也不会互相覆盖临时文件
+    tmp = tempfile.NamedTemporaryFile(
+        dir=MEMORY_FILE.parent, prefix=f"{MEMORY_FILE.name}.", suffix=".tmp", delete=False
     )
+    try:
+        with tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+            # NamedTemporaryFile 固定以 0600 创建，替换前恢复原文件权限（无原文件时按 umask 默认值）
+            os.chmod(tmp.name, _memory_file_mode())
+            # 在替换前取临时文件自身的标识（rename 会保留），避免替换后被其他进程的写入抢先
+            key = _file_key(os.fstat(tmp.fileno()))
+        os.replace(tmp.name, MEMORY_FILE)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    _mem_cache = (key, content)
 
 
 def get_memory_system_prompt() -> str:
@@ -74,25 +129,109 @@ def _truncate_text(text: str, max_chars: int = PYTHON_TOOL_MAX_OUTPUT_CHARS) ->
     return f"{text[:half]}\n...<truncated>...\n{text[-half:]}"
 
 
+# 预启动的一次性 Python 子进程：解释器启动开销提前支付，代码经 stdin 送入；
+# 每个进程只执行一次即退出，调用之间不会残留状态，超时直接 kill。
+_WORKER_BOOTSTRAP = (
+    "import sys, traceback\n"
+    "code = sys.stdin.read()\n"
+    "try:\n"
+    "    exec(compile(code, '<string>', 'exec'), {'__name__': '__main__'})\n"
+    "except SystemExit:\n"
+    "    raise\n"
+    "except BaseException as e:\n"
+    "    traceback.print_exception(type(e), e, e.__traceback__.tb_next)\n"
+    "    sys.exit(1)\n"
+)
+# 每个 uvicorn worker 进程各自维护空闲进程，整体常驻数为 worker 数 × 该值
+_WARM_WORKERS = 1
+
+_idle_workers: List[subprocess.Popen] = []
+_workers_lock = threading.Lock()
+
+
+def _spawn_worker() -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-c", _WORKER_BOOTSTRAP],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env={**os.environ, "PYTHONIOENCODING": "utf-8"},
+    )
+
+
+def _take_worker() -> subprocess.Popen:
+    """取出一个预热进程（没有则现启动），并补足空闲进程数。"""
+    with _workers_lock:
+        while _idle_workers:
+            proc = _idle_workers.pop()
+            if proc.poll() is None:
+                break
+        else:
+            proc = _spawn_worker()
+        while len(_idle_workers) < _WARM_WORKERS:
+            _idle_workers.append(_spawn_worker())
+    return proc
+
+
+def shutdown_python_workers() -> None:
+    """结束所有空闲的预热进程（服务退出时调用）。"""
+    with _workers_lock:
+        while _idle_workers:
+            proc = _idle_workers.pop()
+            proc.kill()
+            proc.wait()
+
+
+def _run_in_worker(proc: subprocess.Popen, payload: bytes) -> Dict[str, Any]:
+    """将代码送入已取出的预热进程并等待结果；无论如何结束，都会回收该进程。"""
+    try:
+        stdout, stderr = proc.communicate(payload, timeout=PYTHON_TOOL_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return {"ok": False, "error": f"python execution timed out after {PYTHON_TOOL_TIMEOUT_SECONDS}s"}
+    finally:
+        # communicate 未正常完成时确保子进程被结束并回收
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    return {
+        "ok": proc.returncode == 0,
+        "returncode": proc.returncode,
+        "stdout": _truncate_text(stdout.decode("utf-8", "replace")),
+        "stderr": _truncate_text(stderr.decode("utf-8", "replace")),
+    }
+
+
 def run_python_tool(code: str) -> Dict[str, Any]:
     code = (code or "").strip()
     if not code:
         return {"ok": False, "error": "code is empty"}
     try:
-        completed = subprocess.run(
-            [sys.executable, "-c", code],
-            capture_output=True,
-            text=True,
-            timeout=PYTHON_TOOL_TIMEOUT_SECONDS,
-        )
-        return {
-            "ok": completed.returncode == 0,
-            "returncode": completed.returncode,
-            "stdout": _truncate_text(completed.stdout or ""),
-            "stderr": _truncate_text(completed.stderr or ""),
-        }
-    except subprocess.TimeoutExpired:
-        return {"ok": False, "error": f"python execution timed out after {PYTHON_TOOL_TIMEOUT_SECONDS}s"}
+        # 先编码再取进程：编码失败（如孤立代理字符）时不会占用预热进程
+        payload = code.encode("utf-8")
+        return _run_in_worker(_take_worker(), payload)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+async def run_python_tool_async(code: str) -> Dict[str, Any]:
+    """run_python_tool 的异步版本：在线程中等待子进程结果，不阻塞事件循环；被取消时结束子进程。"""
+    code = (code or "").strip()
+    if not code:
+        return {"ok": False, "error": "code is empty"}
+    try:
+        payload = code.encode("utf-8")
+        proc = _take_worker()
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, _run_in_worker, proc, payload)
+    except asyncio.CancelledError:
+        # 客户端断开或团队生成器取消成员任务：kill 后执行线程中的 communicate 立即返回
+        proc.kill()
+        raise
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
@@ -100,7 +239,7 @@ def run_python_tool(code: str) -> Dict[str, Any]:
 # ──────────────────────────────────────────────────────────────
 # 工具注册表
 # ──────────────────────────────────────────────────────────────
-TOOLS: List[Dict[str, Any]] = [
+TOOLS: Tuple[Dict[str, Any], ...] = (
     {
         "type": "function",
         "function": {
@@ -139,7 +278,7 @@ TOOLS: List[Dict[str, Any]] = [
             }
         }
     },
-]
+)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -162,12 +301,12 @@ def _normalize_tool_arguments(raw_args: Any) -> Dict[str, Any]:
 # ──────────────────────────────────────────────────────────────
 # 统一工具调度入口
 # ──────────────────────────────────────────────────────────────
-def dispatch_tool(tool_name: str, raw_args: Any) -> Dict[str, Any]:
+async def dispatch_tool(tool_name: str, raw_args: Any) -> Dict[str, Any]:
     """根据工具名称调度执行，统一返回结果字典。"""
     args = _normalize_tool_arguments(raw_args)
 
     if tool_name == "python_exec":
-        return run_python_tool(str(args.get("code", "")))
+        return await run_python_tool_async(str(args.get("code", "")))
 
     if tool_name == "memory_tool":
         return run_memory_tool(content=args.get("content"))